@@ -22,6 +22,7 @@ import copy
 import datetime
 import functools
 import inspect
+import random
 import sys
 
 from oslo_db import api as oslo_db_api
@@ -33,6 +34,7 @@ from oslo_log import log as logging
 from oslo_utils import importutils
 from oslo_utils import timeutils
 from oslo_utils import uuidutils
+from oslo_utils import versionutils
 import six
 from six.moves import range
 import sqlalchemy as sa
@@ -143,6 +145,13 @@ def get_api_engine():
 
 _SHADOW_TABLE_PREFIX = 'shadow_'
 _DEFAULT_QUOTA_NAME = 'default'
+# How many addresses fixed_ip_associate_pool tries to claim per transaction,
+# and how far past the oldest free address it looks after losing a race.
+_FIXED_IP_POOL_ATTEMPTS = 3
+_FIXED_IP_POOL_SPREAD = 16
+# SELECT ... FOR UPDATE SKIP LOCKED is only available from SQLAlchemy 1.1.
+_SKIP_LOCKED_SUPPORTED = versionutils.is_compatible(
+    '1.1.0', sa.__version__, same_major=False)
 PER_PROJECT_QUOTAS = ['fixed_ips', 'floating_ips', 'networks']
 
 
@@ -1250,7 +1259,8 @@ def fixed_ip_associate_pool(context, network_id, instance_uuid=None,
 
     This allocates an unallocated fixed ip out of a specified
     network. We sort by updated_at to hand out the oldest address in
-    the list.
+    the list. If a concurrent transaction claims it first, one of the
+    next oldest addresses is tried instead.
 
     """
     if instance_uuid and not uuidutils.is_uuid_like(instance_uuid):
@@ -1258,18 +1268,54 @@ def fixed_ip_associate_pool(context, network_id, instance_uuid=None,
 
     network_or_none = or_(models.FixedIp.network_id == network_id,
                           models.FixedIp.network_id == null())
-    fixed_ip_ref = model_query(context, models.FixedIp, read_deleted="no").\
-                           filter(network_or_none).\
-                           filter_by(reserved=False).\
-                           filter_by(instance_uuid=None).\
-                           filter_by(host=None).\
-                           filter_by(leased=False).\
-                           order_by(asc(models.FixedIp.updated_at)).\
-                           first()
-
-    if not fixed_ip_ref:
+    query = model_query(context, models.FixedIp, read_deleted="no").\
+                    filter(network_or_none).\
+                    filter_by(reserved=False).\
+                    filter_by(instance_uuid=None).\
+                    filter_by(host=None).\
+                    filter_by(leased=False).\
+                    order_by(asc(models.FixedIp.updated_at))
+    limit = _FIXED_IP_POOL_SPREAD + 1
+    if (_SKIP_LOCKED_SUPPORTED and
+            _db_connection_type(CONF.database.connection) == 'postgresql'):
+        # NOTE(hemmmapart): Concurrent allocations from the same network all
+        # pick the same oldest row and then lose the compare-and-swap below,
+        # burning a retry (and a round-trip) each. On PostgreSQL we can lock
+        # the candidate and skip rows already claimed by other transactions
+        # so every allocator gets a distinct address on the first attempt.
+        # This is not done on MySQL since row locks are not replicated by
+        # Galera.
+        query = query.with_for_update(skip_locked=True)
+        limit = 1
+    candidates = query.limit(limit).all()
+
+    if not candidates:
         raise exception.NoMoreFixedIps(net=network_id)
 
+    # NOTE(hemmmapart): Everyone allocating from this network races for the
+    # same oldest address, so if another transaction claims it first, rather
+    # than rolling back and racing for it again, optimistically try a few of
+    # the next oldest ones at random.
+    others = candidates[1:]
+    others = random.sample(others,
+                           min(len(others), _FIXED_IP_POOL_ATTEMPTS - 1))
+    for fixed_ip_ref in [candidates[0]] + others:
+        if _fixed_ip_claim(context, fixed_ip_ref, network_id, instance_uuid,
+                           host, virtual_interface_id):
+            return fixed_ip_ref
+
+    LOG.debug('The row was updated in a concurrent transaction, '
+              'we will fetch another row')
+    raise db_exc.RetryRequest(
+        exception.FixedIpAssociateFailed(net=network_id))
+
+
+def _fixed_ip_claim(context, fixed_ip_ref, network_id, instance_uuid, host,
+                    virtual_interface_id):
+    """Associate a free fixed ip unless a concurrent transaction did first.
+
+    Returns the number of rows updated.
+    """
     params = {'allocated': virtual_interface_id is not None}
     if fixed_ip_ref['network_id'] is None:
         params['network_id'] = network_id
@@ -1280,7 +1326,7 @@ def fixed_ip_associate_pool(context, network_id, instance_uuid=None,
     if virtual_interface_id:
         params['virtual_interface_id'] = virtual_interface_id
 
-    rows_updated = model_query(context, models.FixedIp, read_deleted="no").\
+    return model_query(context, models.FixedIp, read_deleted="no").\
         filter_by(id=fixed_ip_ref['id']).\
         filter_by(network_id=fixed_ip_ref['network_id']).\
         filter_by(reserved=False).\
@@ -1290,14 +1336,6 @@ def fixed_ip_associate_pool(context, network_id, instance_uuid=None,
         filter_by(address=fixed_ip_ref['address']).\
         update(params, synchronize_session='evaluate')
 
-    if not rows_updated:
-        LOG.debug('The row was updated in a concurrent transaction, '
-                  'we will fetch another row')
-        raise db_exc.RetryRequest(
-            exception.FixedIpAssociateFailed(net=network_id))
-
-    return fixed_ip_ref
-
 
 @require_context
 @pick_context_manager_writer
@@ -3325,6 +3363,17 @@ def network_get_all_by_host(context, host):
 @oslo_db_api.wrap_db_retry(max_retries=5, retry_on_deadlock=True)
 @pick_context_manager_writer
 def network_set_host(context, network_id, host_id):
+    # NOTE(hemmmapart): Try the conditional update straight away; the
+    # network only needs to be read when it was not updated, to tell a
+    # missing network from one that already has a host.
+    rows_updated = _network_get_query(context).\
+        filter_by(id=network_id).\
+        filter_by(host=None).\
+        update({'host': host_id})
+
+    if rows_updated:
+        return
+
     network_ref = _network_get_query(context).\
         filter_by(id=network_id).\
         first()
@@ -3335,16 +3384,10 @@ def network_set_host(context, network_id, host_id):
     if network_ref.host:
         return None
 
-    rows_updated = _network_get_query(context).\
-        filter_by(id=network_id).\
-        filter_by(host=None).\
-        update({'host': host_id})
-
-    if not rows_updated:
-        LOG.debug('The row was updated in a concurrent transaction, '
-                  'we will fetch another row')
-        raise db_exc.RetryRequest(
-            exception.NetworkSetHostFailed(network_id=network_id))
+    LOG.debug('The row was updated in a concurrent transaction, '
+              'we will fetch another row')
+    raise db_exc.RetryRequest(
+        exception.NetworkSetHostFailed(network_id=network_id))
 
 
 @require_context
@@ -885,7 +885,9 @@ class FixedIp(BASE, NovaBase, models.SoftDeleteMixin):
         Index('fixed_ips_deleted_allocated_idx', 'address', 'deleted',
               'allocated'),
         Index('fixed_ips_deleted_allocated_updated_at_idx', 'deleted',
-              'allocated', 'updated_at')
+              'allocated', 'updated_at'),
+        Index('fixed_ips_network_id_deleted_instance_uuid_host_idx',
+              'network_id', 'deleted', 'instance_uuid', 'host')
     )
     id = Column(Integer, primary_key=True)
     address = Column(types.IPAddress())
@@ -24,6 +24,11 @@ import six
 
 from nova.i18n import _
 
+# NOTE(hemmmapart): Parse the constant addresses once rather than on every
+# call.
+_STATIC_NUM = netaddr.IPAddress(0xff << 24)
+_MAC_MASK = netaddr.IPAddress('::ff:ffff')
+
 
 def to_global(prefix, mac, project_id):
     addr = project_id
@@ -33,7 +38,6 @@ def to_global(prefix, mac, project_id):
     addr = int(addr.hexdigest()[:8], 16) << 32
 
     project_hash = netaddr.IPAddress(addr)
-    static_num = netaddr.IPAddress(0xff << 24)
 
     try:
         mac_suffix = netaddr.EUI(mac).value & 0xffffff
@@ -43,13 +47,12 @@ def to_global(prefix, mac, project_id):
 
     try:
         maskIP = netaddr.IPNetwork(prefix).ip
-        return (project_hash ^ static_num ^ mac_addr | maskIP).format()
+        return (project_hash ^ _STATIC_NUM ^ mac_addr | maskIP).format()
     except netaddr.AddrFormatError:
         raise TypeError(_('Bad prefix for to_global_ipv6: %s') % prefix)
 
 
 def to_mac(ipv6_address):
     address = netaddr.IPAddress(ipv6_address)
-    mask1 = netaddr.IPAddress('::ff:ffff')
-    mac = netaddr.EUI(int(address & mask1)).words
+    mac = netaddr.EUI(int(address & _MAC_MASK)).words
     return ':'.join(['02', '16', '3e'] + ['%02x' % i for i in mac[3:6]])
@@ -21,6 +21,10 @@ import netaddr
 
 from nova.i18n import _
 
+# NOTE(hemmmapart): Parse the constant masks once rather than on every call.
+_MAC64_MASK = netaddr.IPAddress('::ffff:ffff:ffff:ffff')
+_UNIVERSAL_LOCAL_BIT = netaddr.IPAddress('::0200:0:0:0')
+
 
 def to_global(prefix, mac, project_id):
     try:
@@ -38,7 +42,6 @@ def to_global(prefix, mac, project_id):
 
 def to_mac(ipv6_address):
     address = netaddr.IPAddress(ipv6_address)
-    mask1 = netaddr.IPAddress('::ffff:ffff:ffff:ffff')
-    mask2 = netaddr.IPAddress('::0200:0:0:0')
-    mac64 = netaddr.EUI(int(address & mask1 ^ mask2)).words
+    mac64 = netaddr.EUI(
+        int(address & _MAC64_MASK ^ _UNIVERSAL_LOCAL_BIT)).words
     return ':'.join(['%02x' % i for i in mac64[0:3] + mac64[5:8]])
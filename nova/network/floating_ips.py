@@ -137,11 +137,9 @@ class FloatingIP(object):
         # add to kwargs so we can pass to super to save a db lookup there
         kwargs['fixed_ips'] = fixed_ips
         for fixed_ip in fixed_ips:
-            fixed_id = fixed_ip.id
-            floating_ips = objects.FloatingIPList.get_by_fixed_ip_id(context,
-                                                                     fixed_id)
-            # disassociate floating ips related to fixed_ip
-            for floating_ip in floating_ips:
+            # disassociate floating ips related to fixed_ip, these were
+            # already joined in by FixedIPList.get_by_instance_uuid
+            for floating_ip in fixed_ip.floating_ips:
                 address = str(floating_ip.address)
                 try:
                     self.disassociate_floating_ip(context,
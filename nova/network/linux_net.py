@@ -21,6 +21,7 @@ import calendar
 import inspect
 import os
 import re
+import threading
 import time
 
 import netaddr
@@ -361,6 +362,11 @@ class IptablesManager(object):
             s += [('ip6tables', self.ipv6)]
 
         for cmd, tables in s:
+            # NOTE(hemmmapart): Most changes (floating IPs, forwarding rules)
+            # only touch the ipv4 tables, so don't save and restore a family
+            # none of whose tables have changed.
+            if not any(table.dirty for table in tables.values()):
+                continue
             all_tables, _err = self.execute('%s-save' % (cmd,), '-c',
                                                 run_as_root=True,
                                                 attempts=5)
@@ -1158,7 +1164,8 @@ def _host_dhcp_opts(vif_id=None, gateway=None):
 def _execute(*cmd, **kwargs):
     """Wrapper around utils._execute for fake_network."""
     if CONF.fake_network:
-        LOG.debug('FAKE NET: %s', ' '.join(map(str, cmd)))
+        if LOG.isEnabledFor(logging.DEBUG):
+            LOG.debug('FAKE NET: %s', ' '.join(map(str, cmd)))
         return 'fake', 0
     else:
         return utils.execute(*cmd, **kwargs)
@@ -1263,6 +1270,11 @@ def delete_bridge_dev(dev):
 # act as gateway/dhcp/vpn/etc. endpoints not VM interfaces.
 interface_driver = None
 
+# (vlan_num, bridge, bridge_interface, mac_address, mtu) of the vlan bridges
+# this process has set up and not removed since.
+_ENSURED_VLAN_BRIDGES = set()
+_ENSURED_VLAN_BRIDGES_LOCK = threading.Lock()
+
 
 def _get_interface_driver():
     global interface_driver
@@ -1355,15 +1367,34 @@ class LinuxBridgeInterfaceDriver(LinuxNetInterfaceDriver):
                            net_attrs=None, mac_address=None,
                            mtu=None):
         """Create a vlan and bridge unless they already exist."""
+        # NOTE(hemmmapart): This runs on every fixed IP allocation, and even
+        # when the devices exist ensure_bridge forks several ip and brctl
+        # commands, so skip it for a vlan bridge we already set up as long
+        # as both devices are still there. Checking that only reads sysfs.
+        key = (vlan_num, bridge, bridge_interface, mac_address, mtu)
+        vlan_interface = 'vlan%s' % vlan_num
+        with _ENSURED_VLAN_BRIDGES_LOCK:
+            if key in _ENSURED_VLAN_BRIDGES:
+                if (linux_net_utils.device_exists(bridge) and
+                        linux_net_utils.device_exists(vlan_interface)):
+                    return vlan_interface
+                # something removed the devices behind our back
+                _ENSURED_VLAN_BRIDGES.discard(key)
         interface = LinuxBridgeInterfaceDriver.ensure_vlan(vlan_num,
                                                bridge_interface, mac_address,
                                                mtu)
         LinuxBridgeInterfaceDriver.ensure_bridge(bridge, interface, net_attrs)
+        with _ENSURED_VLAN_BRIDGES_LOCK:
+            _ENSURED_VLAN_BRIDGES.add(key)
         return interface
 
     @staticmethod
     def remove_vlan_bridge(vlan_num, bridge):
         """Delete a bridge and vlan."""
+        with _ENSURED_VLAN_BRIDGES_LOCK:
+            for key in list(_ENSURED_VLAN_BRIDGES):
+                if key[0] == vlan_num or key[1] == bridge:
+                    _ENSURED_VLAN_BRIDGES.discard(key)
         LinuxBridgeInterfaceDriver.remove_bridge(bridge)
         LinuxBridgeInterfaceDriver.remove_vlan(vlan_num)
 
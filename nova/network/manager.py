@@ -83,6 +83,16 @@ def get_my_linklocal(interface):
         raise exception.NovaException(msg)
 
 
+def _sort_by_requested_uuids(networks, network_uuids):
+    """Sort networks in the order their uuids were requested in."""
+    # NOTE(hemmmapart): Look each position up once instead of searching the
+    # requested uuids for every comparison key.
+    positions = {}
+    for position, uuid in enumerate(network_uuids):
+        positions.setdefault(uuid, position)
+    networks.sort(key=lambda x: positions[x.uuid])
+
+
 class RPCAllocateFixedIP(object):
     """Mixin class originally for FlatDCHP and VLAN network managers.
 
@@ -218,6 +228,9 @@ class NetworkManager(manager.Manager):
 
         self.quotas_cls = objects.Quotas
 
+        # dhcp addresses reserved for this host, keyed by network id
+        self._dhcp_ips = {}
+
         super(NetworkManager, self).__init__(service_name='network',
                                              *args, **kwargs)
 
@@ -226,7 +239,6 @@ class NetworkManager(manager.Manager):
         shared = network.get('share_address') or CONF.share_dhcp_address
         return not network.get('multi_host') or shared
 
-    @utils.synchronized('get_dhcp')
     def _get_dhcp_ip(self, context, network_ref, host=None):
         """Get the proper dhcp address to listen on."""
         # NOTE(vish): If we are sharing the dhcp_address then we can just
@@ -237,17 +249,39 @@ class NetworkManager(manager.Manager):
         if not host:
             host = self.host
         network_id = network_ref['id']
-        try:
-            fip = objects.FixedIP.get_by_network_and_host(context,
-                                                               network_id,
-                                                               host)
-            return fip.address
-        except exception.FixedIpNotFoundForNetworkHost:
-            elevated = context.elevated()
-            fip = objects.FixedIP.associate_pool(elevated,
-                                                      network_id,
-                                                      host=host)
+
+        # NOTE(hemmmapart): Once this host's address is known, reading it
+        # back is a single dict lookup, so don't wait on the lock for it.
+        if host == self.host:
+            address = self._dhcp_ips.get(network_id)
+            if address is not None:
+                return address
+
+        # NOTE(hemmmapart): Only lookups for the same network can race to
+        # reserve a dhcp address, so lock per network rather than making
+        # every network setup on this host wait on a single lock.
+        @utils.synchronized('get_dhcp-%s' % network_id)
+        def do_get_dhcp_ip():
+            # another lookup may have reserved it while we waited
+            if host == self.host and network_id in self._dhcp_ips:
+                return self._dhcp_ips[network_id]
+            try:
+                fip = objects.FixedIP.get_by_network_and_host(context,
+                                                              network_id,
+                                                              host)
+            except exception.FixedIpNotFoundForNetworkHost:
+                elevated = context.elevated()
+                fip = objects.FixedIP.associate_pool(elevated,
+                                                     network_id,
+                                                     host=host)
+            # NOTE(hemmmapart): The address reserved for this host stays
+            # reserved until the host releases it when tearing the network
+            # down, so remember it instead of asking the database again on
+            # every network setup and nw_info lookup.
+            if host == self.host:
+                self._dhcp_ips[network_id] = fip.address
             return fip.address
+        return do_get_dhcp_ip()
 
     def get_dhcp_leases(self, ctxt, network_ref):
         """Broker the request to the driver to fetch the dhcp leases."""
@@ -417,10 +451,13 @@ class NetworkManager(manager.Manager):
         networks = self._get_networks_for_instance(context,
                                         instance_uuid, project_id,
                                         requested_networks=requested_networks)
-        networks_list = [self._get_network_dict(network)
-                                 for network in networks]
-        LOG.debug('Networks retrieved for instance: |%s|',
-                  networks_list, instance_uuid=instance_uuid)
+        # NOTE(hemmmapart): The network dicts are only built for this log
+        # message, so skip building them unless it will be emitted.
+        if LOG.isEnabledFor(logging.DEBUG):
+            networks_list = [self._get_network_dict(network)
+                             for network in networks]
+            LOG.debug('Networks retrieved for instance: |%s|',
+                      networks_list, instance_uuid=instance_uuid)
 
         try:
             self._allocate_mac_addresses(admin_context, instance_uuid,
@@ -973,6 +1010,12 @@ class NetworkManager(manager.Manager):
                     self.instance_dns_domain)
 
         fixed_ip_ref.allocated = False
+        if not self.timeout_fixed_ips:
+            # NOTE(hemmmapart): Without leases to time out, the fixed IP
+            # is handed back right away, so drop the instance association
+            # in the same update instead of with another round trip.
+            fixed_ip_ref.instance_uuid = None
+            fixed_ip_ref.virtual_interface_id = None
         fixed_ip_ref.save()
 
         if teardown:
@@ -1384,7 +1427,10 @@ class NetworkManager(manager.Manager):
             networks.objects.append(net)
 
             if cidr and subnet_v4:
-                self._create_fixed_ips(context, net.id, fixed_cidr,
+                # NOTE(hemmmapart): Hand over the subnet we just created the
+                # network with so it doesn't have to be read back again.
+                self._create_fixed_ips(context, net.id,
+                                       fixed_cidr or subnet_v4,
                                        extra_reserved, bottom_reserved,
                                        top_reserved)
         # NOTE(danms): Remove this in RPC API v2.0
@@ -1419,21 +1465,20 @@ class NetworkManager(manager.Manager):
                           extra_reserved=None, bottom_reserved=0,
                           top_reserved=0):
         """Create all fixed IPs for network."""
-        network = self._get_network_by_id(context, network_id)
-        if extra_reserved is None:
-            extra_reserved = []
         if not fixed_cidr:
+            network = self._get_network_by_id(context, network_id)
             fixed_cidr = netaddr.IPNetwork(network['cidr'])
+        extra_reserved = set(extra_reserved or [])
+        # NOTE(hemmmapart): Walk the range once instead of indexing into
+        # the network for every address, and only compare against the
+        # extra reserved addresses in the unreserved middle of the range.
         num_ips = len(fixed_cidr)
+        top_index = num_ips - top_reserved
         ips = []
-        for index in range(num_ips):
-            address = str(fixed_cidr[index])
-            if (index < bottom_reserved or num_ips - index <= top_reserved or
-                address in extra_reserved):
-                reserved = True
-            else:
-                reserved = False
-
+        for index, ip in enumerate(fixed_cidr):
+            address = str(ip)
+            reserved = (index < bottom_reserved or index >= top_index or
+                        address in extra_reserved)
             ips.append({'network_id': network_id,
                         'address': address,
                         'reserved': reserved})
@@ -1458,8 +1503,15 @@ class NetworkManager(manager.Manager):
         vifs = objects.VirtualInterfaceList.get_by_instance_uuid(
                 context, instance.uuid)
         LOG.debug('Setup networks on host', instance=instance)
+        # NOTE(hemmmapart): An instance can have several vifs on the same
+        # network. Setting a network up is idempotent, so only look up and
+        # set up each network once rather than once per vif.
+        network_ids = []
         for vif in vifs:
-            network = objects.Network.get_by_id(context, vif.network_id)
+            if vif.network_id not in network_ids:
+                network_ids.append(vif.network_id)
+        for network_id in network_ids:
+            network = objects.Network.get_by_id(context, network_id)
             if not network.multi_host:
                 # NOTE (tr3buchet): if using multi_host, host is instance.host
                 host = network['host']
@@ -1494,6 +1546,15 @@ class NetworkManager(manager.Manager):
             self.l3driver.initialize_network(network.cidr, is_ext)
         self.l3driver.initialize_gateway(network)
 
+    def _update_gateway_v6(self, network, dev):
+        """Record the link local address of dev as the ipv6 gateway."""
+        # NOTE(hemmmapart): The link local address of the bridge
+        # rarely changes, so only write it back when it has.
+        gateway = netaddr.IPAddress(get_my_linklocal(dev))
+        if network.gateway_v6 != gateway:
+            network.gateway_v6 = gateway
+            network.save()
+
     def _setup_network_on_host(self, context, network):
         """Sets up network on this host."""
         raise NotImplementedError()
@@ -1535,7 +1596,7 @@ class NetworkManager(manager.Manager):
     def _get_networks_by_uuids(self, context, network_uuids):
         networks = objects.NetworkList.get_by_uuids(
             context, network_uuids, project_only="allow_none")
-        networks.sort(key=lambda x: network_uuids.index(x.uuid))
+        _sort_by_requested_uuids(networks, network_uuids)
         return networks
 
     def get_vifs_by_instance(self, context, instance_id):
@@ -1683,21 +1744,14 @@ class FlatManager(NetworkManager):
             self.allocate_fixed_ip(context, instance_id,
                                    network, address=address)
 
-    def deallocate_fixed_ip(self, context, address, host=None, teardown=True,
-            instance=None):
-        """Returns a fixed IP to the pool."""
-        super(FlatManager, self).deallocate_fixed_ip(context, address, host,
-                                                     teardown,
-                                                     instance=instance)
-        objects.FixedIP.disassociate_by_address(context, address)
-
     def _setup_network_on_host(self, context, network):
         """Setup Network on this host."""
         # NOTE(tr3buchet): this does not need to happen on every ip
         # allocation, this functionality makes more sense in create_network
         # but we'd have to move the flat_injected flag to compute
-        network.injected = CONF.flat_injected
-        network.save()
+        if network.injected != CONF.flat_injected:
+            network.injected = CONF.flat_injected
+            network.save()
 
     def _teardown_network_on_host(self, context, network):
         """Tear down network on this host."""
@@ -1834,9 +1888,7 @@ class FlatDHCPManager(RPCAllocateFixedIP, floating_ips.FloatingIP,
             self.driver.update_dhcp(elevated, dev, network)
             if CONF.use_ipv6:
                 self.driver.update_ra(context, dev, network)
-                gateway = get_my_linklocal(dev)
-                network.gateway_v6 = gateway
-                network.save()
+                self._update_gateway_v6(network, dev)
 
     def _teardown_network_on_host(self, context, network):
         # NOTE(vish): if dhcp server is not set then don't dhcp
@@ -1929,7 +1981,8 @@ class VlanManager(RPCAllocateFixedIP, floating_ips.FloatingIP, NetworkManager):
             vif = self._add_virtual_interface(context,
                 instance_id, network['id'])
 
-        if kwargs.get('vpn', None):
+        vpn = kwargs.get('vpn', None)
+        if vpn:
             address = network['vpn_private_address']
             fip = objects.FixedIP.associate(context, str(address),
                                             instance_id, network['id'],
@@ -1948,7 +2001,7 @@ class VlanManager(RPCAllocateFixedIP, floating_ips.FloatingIP, NetworkManager):
                         vif_id=vif.id)
         address = fip.address
 
-        if not kwargs.get('vpn', None):
+        if not vpn:
             self._do_trigger_security_group_members_refresh_for_instance(
                                                                    instance_id)
 
@@ -2015,7 +2068,7 @@ class VlanManager(RPCAllocateFixedIP, floating_ips.FloatingIP, NetworkManager):
         #             project yet.
         networks = objects.NetworkList.get_by_uuids(
             context, network_uuids, project_only=True)
-        networks.sort(key=lambda x: network_uuids.index(x.uuid))
+        _sort_by_requested_uuids(networks, network_uuids)
         return networks
 
     def _get_networks_for_instance(self, context, instance_id, project_id,
@@ -2101,9 +2154,7 @@ class VlanManager(RPCAllocateFixedIP, floating_ips.FloatingIP, NetworkManager):
                 self.driver.update_dhcp(elevated, dev, network)
             if CONF.use_ipv6:
                 self.driver.update_ra(context, dev, network)
-                gateway = get_my_linklocal(dev)
-                network.gateway_v6 = gateway
-                network.save()
+                self._update_gateway_v6(network, dev)
 
     @utils.synchronized('setup_network', external=True)
     def _teardown_network_on_host(self, context, network):
@@ -2126,9 +2177,18 @@ class VlanManager(RPCAllocateFixedIP, floating_ips.FloatingIP, NetworkManager):
                 if not self._uses_shared_ip(network):
                     fip = objects.FixedIP.get_by_address(context,
                                                          network.dhcp_server)
-                    fip.allocated = False
-                    fip.host = None
-                    fip.save()
+
+                    # NOTE(hemmmapart): Hold the lock _get_dhcp_ip reserves
+                    # the address under, so a concurrent lookup can't read
+                    # it back from the database and remember it again
+                    # before it is released.
+                    @utils.synchronized('get_dhcp-%s' % network.id)
+                    def do_release_dhcp_ip():
+                        self._dhcp_ips.pop(network.id, None)
+                        fip.allocated = False
+                        fip.host = None
+                        fip.save()
+                    do_release_dhcp_ip()
             # NOTE(vish): if dhcp server is not set then don't dhcp
             elif network.enable_dhcp:
                 # NOTE(dprince): dhcp DB queries require elevated context
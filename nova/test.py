@@ -54,6 +54,7 @@ from nova.api.openstack.placement.objects import resource_provider
 from nova import context
 from nova.db import api as db
 from nova import exception
+from nova.network import linux_net
 from nova.network import manager as network_manager
 from nova.network.security_group import openstack_driver
 from nova import objects
@@ -319,6 +320,8 @@ class TestCase(testtools.TestCase):
         resource_provider._RC_CACHE = None
         # Reset the global QEMU version flag.
         images.QEMU_VERSION = None
+        # Forget the vlan bridges set up by earlier tests.
+        linux_net._ENSURED_VLAN_BRIDGES.clear()
 
         mox_fixture = self.useFixture(moxstubout.MoxStubout())
         self.mox = mox_fixture.mox
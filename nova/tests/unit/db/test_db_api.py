@@ -4426,6 +4426,55 @@ class FixedIPTestCase(test.TestCase, ModelsObjectComparatorMixin):
         fixed_ip = db.fixed_ip_get_by_address(self.ctxt, address)
         self.assertEqual(fixed_ip['instance_uuid'], instance_uuid)
 
+    @mock.patch.object(sqlalchemy_api, '_SKIP_LOCKED_SUPPORTED', True)
+    @mock.patch.object(query.Query, 'with_for_update')
+    def test_fixed_ip_associate_pool_skip_locked_postgresql(self, mock_lock):
+        instance_uuid = self._create_instance()
+        network = db.network_create_safe(self.ctxt, {})
+        address = self.create_fixed_ip(network_id=network['id'])
+        locked_query = mock_lock.return_value
+        locked_query.limit.return_value.all.return_value = [
+            {'network_id': network['id'], 'address': address,
+             'instance_uuid': None, 'host': None, 'id': 1}]
+
+        with mock.patch.object(sqlalchemy_api, '_db_connection_type',
+                               return_value='postgresql'):
+            db.fixed_ip_associate_pool(self.ctxt, network['id'],
+                                       instance_uuid)
+
+        mock_lock.assert_called_once_with(skip_locked=True)
+        # only the row being claimed is locked
+        locked_query.limit.assert_called_once_with(1)
+        fixed_ip = db.fixed_ip_get_by_address(self.ctxt, address)
+        self.assertEqual(instance_uuid, fixed_ip['instance_uuid'])
+
+    @mock.patch.object(query.Query, 'with_for_update')
+    def test_fixed_ip_associate_pool_no_lock_mysql(self, mock_lock):
+        instance_uuid = self._create_instance()
+        network = db.network_create_safe(self.ctxt, {})
+        self.create_fixed_ip(network_id=network['id'])
+
+        with mock.patch.object(sqlalchemy_api, '_db_connection_type',
+                               return_value='mysql'):
+            db.fixed_ip_associate_pool(self.ctxt, network['id'],
+                                       instance_uuid)
+
+        mock_lock.assert_not_called()
+
+    @mock.patch.object(sqlalchemy_api, '_SKIP_LOCKED_SUPPORTED', False)
+    @mock.patch.object(query.Query, 'with_for_update')
+    def test_fixed_ip_associate_pool_no_lock_old_sqlalchemy(self, mock_lock):
+        instance_uuid = self._create_instance()
+        network = db.network_create_safe(self.ctxt, {})
+        self.create_fixed_ip(network_id=network['id'])
+
+        with mock.patch.object(sqlalchemy_api, '_db_connection_type',
+                               return_value='postgresql'):
+            db.fixed_ip_associate_pool(self.ctxt, network['id'],
+                                       instance_uuid)
+
+        mock_lock.assert_not_called()
+
     def test_fixed_ip_associate_pool_succeeds_fip_ref_network_id_is_none(self):
         instance_uuid = self._create_instance()
         network = db.network_create_safe(self.ctxt, {})
@@ -4442,18 +4491,18 @@ class FixedIPTestCase(test.TestCase, ModelsObjectComparatorMixin):
 
         address = self.create_fixed_ip(network_id=network['id'])
 
-        def fake_first():
-            if mock_first.call_count == 1:
-                return {'network_id': network['id'], 'address': 'invalid',
-                        'instance_uuid': None, 'host': None, 'id': 1}
+        def fake_all():
+            if mock_all.call_count == 1:
+                return [{'network_id': network['id'], 'address': 'invalid',
+                         'instance_uuid': None, 'host': None, 'id': 1}]
             else:
-                return {'network_id': network['id'], 'address': address,
-                        'instance_uuid': None, 'host': None, 'id': 1}
+                return [{'network_id': network['id'], 'address': address,
+                         'instance_uuid': None, 'host': None, 'id': 1}]
 
-        with mock.patch('sqlalchemy.orm.query.Query.first',
-                        side_effect=fake_first) as mock_first:
+        with mock.patch('sqlalchemy.orm.query.Query.all',
+                        side_effect=fake_all) as mock_all:
             db.fixed_ip_associate_pool(self.ctxt, network['id'], instance_uuid)
-            self.assertEqual(2, mock_first.call_count)
+            self.assertEqual(2, mock_all.call_count)
 
         fixed_ip = db.fixed_ip_get_by_address(self.ctxt, address)
         self.assertEqual(instance_uuid, fixed_ip['instance_uuid'])
@@ -4464,17 +4513,56 @@ class FixedIPTestCase(test.TestCase, ModelsObjectComparatorMixin):
 
         self.create_fixed_ip(network_id=network['id'])
 
-        def fake_first():
-            return {'network_id': network['id'], 'address': 'invalid',
-                    'instance_uuid': None, 'host': None, 'id': 1}
+        def fake_all():
+            return [{'network_id': network['id'], 'address': 'invalid',
+                     'instance_uuid': None, 'host': None, 'id': 1}]
 
-        with mock.patch('sqlalchemy.orm.query.Query.first',
-                        side_effect=fake_first) as mock_first:
+        with mock.patch('sqlalchemy.orm.query.Query.all',
+                        side_effect=fake_all) as mock_all:
             self.assertRaises(exception.FixedIpAssociateFailed,
                               db.fixed_ip_associate_pool, self.ctxt,
                               network['id'], instance_uuid)
             # 5 retries + initial attempt
-            self.assertEqual(6, mock_first.call_count)
+            self.assertEqual(6, mock_all.call_count)
+
+    def test_fixed_ip_associate_pool_lost_race_tries_next_oldest(self):
+        instance_uuid = self._create_instance()
+        network = db.network_create_safe(self.ctxt, {})
+        self.addCleanup(timeutils.clear_time_override)
+        start = timeutils.utcnow()
+        addresses = []
+        for i in range(1, 4):
+            now = start - datetime.timedelta(hours=4 - i)
+            timeutils.set_time_override(now)
+            addresses.append(self.create_fixed_ip(
+                updated_at=now,
+                address='10.1.0.%d' % i,
+                network_id=network['id']))
+
+        real_claim = sqlalchemy_api._fixed_ip_claim
+
+        def fake_claim(context, fixed_ip_ref, *args):
+            # a concurrent transaction claims the oldest address first
+            if fixed_ip_ref['address'] == addresses[0]:
+                return 0
+            return real_claim(context, fixed_ip_ref, *args)
+
+        with test.nested(
+            mock.patch.object(sqlalchemy_api, '_fixed_ip_claim',
+                              side_effect=fake_claim),
+            mock.patch('sqlalchemy.orm.query.Query.all',
+                       autospec=True, side_effect=query.Query.all),
+        ) as (mock_claim, mock_all):
+            fixed_ip = db.fixed_ip_associate_pool(self.ctxt, network['id'],
+                                                  instance_uuid)
+        # the candidates are fetched once and the lost race is not retried
+        self.assertEqual(1, mock_all.call_count)
+        self.assertEqual(2, mock_claim.call_count)
+        self.assertIn(fixed_ip['address'], addresses[1:])
+        self.assertIsNone(db.fixed_ip_get_by_address(
+            self.ctxt, addresses[0])['instance_uuid'])
+        self.assertEqual(instance_uuid, db.fixed_ip_get_by_address(
+            self.ctxt, fixed_ip['address'])['instance_uuid'])
 
     def test_fixed_ip_create_same_address(self):
         address = '192.168.1.5'
@@ -6295,6 +6383,17 @@ class NetworkTestCase(test.TestCase, ModelsObjectComparatorMixin):
         self.assertEqual('example.com',
             db.network_get(self.ctxt, network.id).host)
 
+    def test_network_set_host_without_host_single_query(self):
+        # Tests that a network without a host is claimed by the
+        # conditional update alone, without reading it first.
+        values = {'project_id': 'project1'}
+        network = db.network_create_safe(self.ctxt, values)
+        with mock.patch('sqlalchemy.orm.query.Query.first') as mock_first:
+            db.network_set_host(self.ctxt, network.id, 'example.com')
+        self.assertFalse(mock_first.called)
+        self.assertEqual('example.com',
+            db.network_get(self.ctxt, network.id).host)
+
     def test_network_set_host_succeeds_retry_on_deadlock(self):
         values = {'project_id': 'project1'}
         network = db.network_create_safe(self.ctxt, values)
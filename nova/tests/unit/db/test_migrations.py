@@ -1009,6 +1009,12 @@ class NovaMigrationsCheckers(test_migrations.ModelsMigrationsSync,
         self.assertColumnExists(engine, 'shadow_instance_extra',
                                 'trusted_certs')
 
+    def _check_391(self, engine, data):
+        self.assertIndexMembers(
+            engine, 'fixed_ips',
+            'fixed_ips_network_id_deleted_instance_uuid_host_idx',
+            ['network_id', 'deleted', 'instance_uuid', 'host'])
+
 
 class TestNovaMigrationsSQLite(NovaMigrationsCheckers,
                                test_base.DbTestCase,
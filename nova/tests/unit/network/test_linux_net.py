@@ -672,6 +672,61 @@ class LinuxNetworkTestCase(test.NoDBTestCase):
         driver.plug(network, "fakemac")
         self.assertEqual(3, mock_ensure_vlan_bridge.call_count)
 
+    @mock.patch.object(linux_net_utils, 'device_exists', return_value=True)
+    @mock.patch.object(linux_net.LinuxBridgeInterfaceDriver, 'remove_vlan')
+    @mock.patch.object(linux_net.LinuxBridgeInterfaceDriver, 'remove_bridge')
+    @mock.patch.object(linux_net.LinuxBridgeInterfaceDriver, 'ensure_bridge')
+    @mock.patch.object(linux_net.LinuxBridgeInterfaceDriver, 'ensure_vlan',
+                       return_value='vlan100')
+    def test_ensure_vlan_bridge_remembered(self, mock_ensure_vlan,
+                                           mock_ensure_bridge,
+                                           mock_remove_bridge,
+                                           mock_remove_vlan,
+                                           mock_device_exists):
+        driver = linux_net.LinuxBridgeInterfaceDriver
+        for i in range(2):
+            self.assertEqual('vlan100', driver.ensure_vlan_bridge(
+                100, 'br100', 'eth0', mtu=1500))
+        self.assertEqual(1, mock_ensure_vlan.call_count)
+        self.assertEqual(1, mock_ensure_bridge.call_count)
+        mock_device_exists.assert_has_calls([mock.call('br100'),
+                                             mock.call('vlan100')])
+
+        # a changed mtu is still applied
+        driver.ensure_vlan_bridge(100, 'br100', 'eth0', mtu=9000)
+        self.assertEqual(2, mock_ensure_vlan.call_count)
+
+        # and the devices are set up again once they have been removed
+        driver.remove_vlan_bridge(100, 'br100')
+        driver.ensure_vlan_bridge(100, 'br100', 'eth0', mtu=1500)
+        self.assertEqual(3, mock_ensure_vlan.call_count)
+        self.assertEqual(3, mock_ensure_bridge.call_count)
+
+    @mock.patch.object(linux_net_utils, 'device_exists')
+    @mock.patch.object(linux_net.LinuxBridgeInterfaceDriver, 'ensure_bridge')
+    @mock.patch.object(linux_net.LinuxBridgeInterfaceDriver, 'ensure_vlan',
+                       return_value='vlan100')
+    def test_ensure_vlan_bridge_recreates_removed_bridge(
+            self, mock_ensure_vlan, mock_ensure_bridge, mock_device_exists):
+        # Tests that a remembered vlan bridge is set up again when its
+        # bridge was deleted outside of nova.
+        devices = set(['br100', 'vlan100'])
+        mock_device_exists.side_effect = lambda dev: dev in devices
+        driver = linux_net.LinuxBridgeInterfaceDriver
+        driver.ensure_vlan_bridge(100, 'br100', 'eth0')
+        self.assertEqual(1, mock_ensure_bridge.call_count)
+
+        devices.discard('br100')
+        mock_ensure_bridge.side_effect = lambda *a: devices.add('br100')
+        driver.ensure_vlan_bridge(100, 'br100', 'eth0')
+        self.assertEqual(2, mock_ensure_vlan.call_count)
+        self.assertEqual(2, mock_ensure_bridge.call_count)
+        self.assertIn('br100', devices)
+
+        # and is remembered again once it is back
+        driver.ensure_vlan_bridge(100, 'br100', 'eth0')
+        self.assertEqual(2, mock_ensure_bridge.call_count)
+
     @mock.patch.object(linux_net.LinuxBridgeInterfaceDriver, 'ensure_bridge')
     def test_flat_override(self, mock_ensure_bridge):
         """Makes sure flat_interface flag overrides network bridge_interface.
@@ -1047,6 +1102,30 @@ class LinuxNetworkTestCase(test.NoDBTestCase):
             mock_apply.assert_called_once()
             self.assertFalse(manager.iptables_apply_deferred)
 
+    def test_apply_skips_clean_ip_family(self):
+        # Tests that only the ip family with changed tables is saved and
+        # restored.
+        self.flags(use_ipv6=True)
+        executes = []
+
+        def fake_execute(*args, **kwargs):
+            executes.append(args)
+            return "", ""
+
+        manager = linux_net.IptablesManager(execute=fake_execute)
+        manager._apply()
+        self.assertEqual([('iptables-save', '-c'),
+                          ('iptables-restore', '-c'),
+                          ('ip6tables-save', '-c'),
+                          ('ip6tables-restore', '-c')], executes)
+
+        executes = []
+        manager.ipv4['nat'].add_rule('PREROUTING',
+                                     '-d 172.24.4.1 -j DNAT --to 10.0.0.2')
+        manager.apply()
+        self.assertEqual([('iptables-save', '-c'),
+                          ('iptables-restore', '-c')], executes)
+
     @mock.patch.object(linux_net.iptables_manager.ipv4['filter'], 'add_rule')
     def _test_add_metadata_accept_rule(self, expected, mock_add_rule):
         def verify_add_rule(chain, rule):
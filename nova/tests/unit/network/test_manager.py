@@ -15,6 +15,7 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import eventlet
 import fixtures
 import mock
 from mox3 import mox
@@ -862,6 +863,61 @@ class FlatNetworkTestCase(test.TestCase):
                     '9d2ee1e3-ffad-4e5f-81ff-c96dd97b0ee0', network)
         self.assertFalse(mock_fixedip.called, str(mock_fixedip.mock_calls))
 
+    def test_setup_network_on_host_sets_injected(self):
+        self.flags(flat_injected=True)
+        network = fake_network.fake_network_obj(self.context, 1)
+        network.injected = False
+        with mock.patch.object(network, 'save') as mock_save:
+            self.network._setup_network_on_host(self.context, network)
+        self.assertTrue(network.injected)
+        mock_save.assert_called_once_with()
+
+    def test_setup_network_on_host_injected_unchanged(self):
+        # Tests that the network is not saved again on every allocation
+        # when flat_injected already matches.
+        self.flags(flat_injected=True)
+        network = fake_network.fake_network_obj(self.context, 1)
+        network.injected = True
+        with mock.patch.object(network, 'save') as mock_save:
+            self.network._setup_network_on_host(self.context, network)
+        self.assertFalse(mock_save.called)
+
+    @mock.patch.object(objects.FixedIP, 'disassociate_by_address')
+    @mock.patch.object(objects.FixedIP, 'get_by_address')
+    def test_deallocate_fixed_ip_disassociates_in_one_update(
+            self, mock_get_by_address, mock_disassociate_by_address):
+        # Tests that the flat manager frees and disassociates a fixed IP
+        # with a single save.
+        instance = fake_instance.fake_instance_obj(self.context)
+        fip = objects.FixedIP._from_db_object(
+            self.context, objects.FixedIP(), fake_network.next_fixed_ip(1))
+        fip.instance_uuid = instance.uuid
+        fip.allocated = True
+        fip.network = fake_network.fake_network_obj(self.context, 1)
+        fip.obj_reset_changes()
+        mock_get_by_address.return_value = fip
+        self.flags(force_dhcp_release=False)
+
+        def fake_save():
+            self.assertEqual({'allocated', 'instance_uuid',
+                              'virtual_interface_id'},
+                             fip.obj_what_changed())
+
+        with test.nested(
+            mock.patch.object(fip, 'save', side_effect=fake_save),
+            mock.patch.object(
+                self.network,
+                '_do_trigger_security_group_members_refresh_for_instance'),
+        ) as (mock_save, mock_refresh):
+            self.network.deallocate_fixed_ip(self.context, fip.address,
+                                             instance=instance)
+
+        mock_save.assert_called_once_with()
+        self.assertFalse(fip.allocated)
+        self.assertIsNone(fip.instance_uuid)
+        self.assertIsNone(fip.virtual_interface_id)
+        self.assertFalse(mock_disassociate_by_address.called)
+
 
 class FlatDHCPNetworkTestCase(test.TestCase):
 
@@ -2947,6 +3003,40 @@ class FloatingIPTestCase(test.TestCase):
         self.context = context.RequestContext('testuser', self.project_id,
             is_admin=False)
 
+    @mock.patch.object(network_manager.NetworkManager,
+                       'deallocate_for_instance')
+    @mock.patch.object(objects.FloatingIPList, 'get_by_fixed_ip_id')
+    @mock.patch.object(objects.FixedIPList, 'get_by_instance_uuid')
+    def test_deallocate_for_instance_uses_joined_floating_ips(
+            self, mock_get_fixed, mock_get_floating, mock_super_dealloc):
+        # Tests that the floating IPs loaded along with the fixed IPs are
+        # used rather than looking them up again for every fixed IP.
+        instance = fake_instance.fake_instance_obj(self.context)
+        auto_ip = objects.FloatingIP(address=netaddr.IPAddress('172.24.4.1'),
+                                     auto_assigned=True)
+        user_ip = objects.FloatingIP(address=netaddr.IPAddress('172.24.4.2'),
+                                     auto_assigned=False)
+        fixed_ip = objects.FixedIP(
+            id=1, address=netaddr.IPAddress('10.0.0.2'),
+            floating_ips=objects.FloatingIPList(objects=[auto_ip, user_ip]))
+        mock_get_fixed.return_value = [fixed_ip]
+
+        with test.nested(
+            mock.patch.object(self.network, 'disassociate_floating_ip'),
+            mock.patch.object(self.network, 'deallocate_floating_ip'),
+        ) as (mock_disassociate, mock_deallocate):
+            self.network.deallocate_for_instance(self.context,
+                                                 instance=instance)
+
+        mock_get_floating.assert_not_called()
+        mock_disassociate.assert_has_calls([
+            mock.call(self.context, '172.24.4.1', affect_auto_assigned=True),
+            mock.call(self.context, '172.24.4.2', affect_auto_assigned=True)])
+        mock_deallocate.assert_called_once_with(
+            self.context, '172.24.4.1', affect_auto_assigned=True)
+        mock_super_dealloc.assert_called_once_with(
+            self.context, instance=instance, fixed_ips=[fixed_ip])
+
     @mock.patch('nova.db.api.fixed_ip_get')
     @mock.patch('nova.db.api.network_get')
     @mock.patch('nova.db.api.instance_get_by_uuid')
@@ -3749,3 +3839,234 @@ class NetworkManagerNoDBTestCase(test.NoDBTestCase):
             mock_disassociate.assert_called_once_with()
 
         do_test()
+
+    @mock.patch.object(objects.Network, 'get_by_id')
+    @mock.patch.object(objects.VirtualInterfaceList, 'get_by_instance_uuid')
+    def test_setup_networks_on_host_dedupes_networks(self, mock_get_vifs,
+                                                     mock_get_network):
+        # Tests that an instance with several vifs on the same network only
+        # looks up and sets up that network once.
+        instance = fake_instance.fake_instance_obj(self.context)
+        mock_get_vifs.return_value = [
+            objects.VirtualInterface(network_id=1),
+            objects.VirtualInterface(network_id=2),
+            objects.VirtualInterface(network_id=1)]
+        networks = {1: fake_network.fake_network_obj(self.context, 1),
+                    2: fake_network.fake_network_obj(self.context, 2)}
+        for network in networks.values():
+            network.multi_host = True
+        mock_get_network.side_effect = lambda ctxt, net_id: networks[net_id]
+
+        with mock.patch.object(self.manager,
+                               '_setup_network_on_host') as mock_setup:
+            self.manager.setup_networks_on_host(
+                self.context, instance.id, self.manager.host,
+                instance=instance)
+
+        self.assertEqual([mock.call(self.context, 1),
+                          mock.call(self.context, 2)],
+                         mock_get_network.call_args_list)
+        self.assertEqual([mock.call(self.context, networks[1]),
+                          mock.call(self.context, networks[2])],
+                         mock_setup.call_args_list)
+
+    @mock.patch.object(objects.FixedIPList, 'bulk_create')
+    def test_create_fixed_ips_reserved(self, mock_bulk_create):
+        # Tests which addresses are flagged as reserved when the fixed IPs
+        # for a network are created.
+        network = fake_network.fake_network_obj(self.context, 1)
+        with mock.patch.object(self.manager,
+                               '_get_network_by_id') as mock_get_network:
+            self.manager._create_fixed_ips(
+                self.context, network.id,
+                fixed_cidr=netaddr.IPNetwork('192.168.0.0/29'),
+                extra_reserved=['192.168.0.4'], bottom_reserved=2,
+                top_reserved=1)
+
+        # the network is only read back when no fixed_cidr is given
+        self.assertFalse(mock_get_network.called)
+        ips = mock_bulk_create.call_args[0][1]
+        self.assertEqual(['192.168.0.%d' % i for i in range(8)],
+                         [ip['address'] for ip in ips])
+        self.assertEqual([True, True, False, False, True, False, False, True],
+                         [ip['reserved'] for ip in ips])
+        self.assertTrue(all(ip['network_id'] == network.id for ip in ips))
+
+    @mock.patch.object(objects.FixedIP, 'get_by_network_and_host')
+    def test_get_dhcp_ip_locks_per_network(self, mock_get_by_net_host):
+        # Tests that reserving the dhcp address for a network which does not
+        # share it only serializes with other lookups for the same network.
+        network = fake_network.fake_network_obj(self.context, 2)
+        network.multi_host = True
+        network.share_address = False
+        mock_get_by_net_host.return_value = objects.FixedIP(
+            address=netaddr.IPAddress('192.168.2.5'))
+
+        with mock.patch('nova.utils.synchronized',
+                        wraps=utils.synchronized) as mock_synchronized:
+            address = self.manager._get_dhcp_ip(self.context, network)
+
+        self.assertEqual('192.168.2.5', str(address))
+        mock_synchronized.assert_called_once_with('get_dhcp-2')
+        mock_get_by_net_host.assert_called_once_with(self.context, 2,
+                                                     self.manager.host)
+
+    def test_get_dhcp_ip_shared_address_no_lock(self):
+        network = fake_network.fake_network_obj(self.context, 2)
+        network.multi_host = False
+        with mock.patch('nova.utils.synchronized') as mock_synchronized:
+            address = self.manager._get_dhcp_ip(self.context, network)
+
+        self.assertEqual(network.dhcp_server, address)
+        mock_synchronized.assert_not_called()
+
+    @mock.patch.object(objects.FixedIP, 'get_by_network_and_host')
+    def test_get_dhcp_ip_remembers_own_address(self, mock_get_by_net_host):
+        network = fake_network.fake_network_obj(self.context, 2)
+        network.multi_host = True
+        network.share_address = False
+        mock_get_by_net_host.return_value = objects.FixedIP(
+            address=netaddr.IPAddress('192.168.2.5'))
+
+        for i in range(2):
+            address = self.manager._get_dhcp_ip(self.context, network)
+            self.assertEqual('192.168.2.5', str(address))
+
+        mock_get_by_net_host.assert_called_once_with(self.context, 2,
+                                                     self.manager.host)
+
+    @mock.patch.object(objects.FixedIP, 'get_by_network_and_host')
+    def test_get_dhcp_ip_remembered_address_no_lock(self,
+                                                    mock_get_by_net_host):
+        # Tests that reading back the address already reserved for this
+        # host does not wait on the per network lock.
+        network = fake_network.fake_network_obj(self.context, 2)
+        network.multi_host = True
+        network.share_address = False
+        self.manager._dhcp_ips[2] = netaddr.IPAddress('192.168.2.5')
+
+        with mock.patch('nova.utils.synchronized') as mock_synchronized:
+            address = self.manager._get_dhcp_ip(self.context, network)
+
+        self.assertEqual('192.168.2.5', str(address))
+        self.assertFalse(mock_synchronized.called)
+        self.assertFalse(mock_get_by_net_host.called)
+
+    @mock.patch.object(objects.FixedIP, 'get_by_network_and_host')
+    def test_get_dhcp_ip_other_host_not_remembered(self,
+                                                   mock_get_by_net_host):
+        # Tests that the dhcp address of another host is always looked up
+        # since that host may release it without us knowing.
+        network = fake_network.fake_network_obj(self.context, 2)
+        network.multi_host = True
+        network.share_address = False
+        mock_get_by_net_host.return_value = objects.FixedIP(
+            address=netaddr.IPAddress('192.168.2.6'))
+
+        for i in range(2):
+            self.manager._get_dhcp_ip(self.context, network, host='other')
+
+        self.assertEqual(2, mock_get_by_net_host.call_count)
+
+    @mock.patch.object(objects.Network, 'in_use_on_host', return_value=False)
+    @mock.patch.object(objects.FixedIP, 'associate_pool')
+    @mock.patch.object(objects.FixedIP, 'get_by_address')
+    @mock.patch.object(objects.FixedIP, 'get_by_network_and_host')
+    def test_teardown_network_forgets_released_dhcp_ip(self,
+                                                       mock_get_by_net_host,
+                                                       mock_get_by_address,
+                                                       mock_associate,
+                                                       mock_in_use):
+        self.flags(fake_network=False, teardown_unused_network_gateway=True)
+        self.flags(lock_path=self.useFixture(fixtures.TempDir()).path,
+                   group='oslo_concurrency')
+        manager = network_manager.VlanManager()
+        network = fake_network.fake_network_obj(self.context, 2)
+        network.multi_host = True
+        network.share_address = False
+        network.enable_dhcp = True
+        network.vpn_public_address = '10.0.0.2'
+        dhcp_fip = objects.FixedIP(address=netaddr.IPAddress('192.168.2.5'))
+        mock_get_by_address.return_value = dhcp_fip
+        mock_associate.return_value = objects.FixedIP(
+            address=netaddr.IPAddress('192.168.2.6'))
+        released = []
+        lookups = []
+
+        def fake_get_by_network_and_host(context, network_id, host):
+            if released:
+                raise exception.FixedIpNotFoundForNetworkHost(
+                    network_id=network_id, host=host)
+            return dhcp_fip
+
+        def fake_save():
+            # a concurrent lookup, e.g. from get_instance_nw_info, between
+            # forgetting the address and releasing it in the database
+            lookups.append(eventlet.spawn(manager._get_dhcp_ip,
+                                          self.context, network))
+            eventlet.sleep(0)
+            released.append(True)
+
+        mock_get_by_net_host.side_effect = fake_get_by_network_and_host
+        with test.nested(
+            mock.patch.object(manager, 'driver'),
+            mock.patch.object(manager, 'l3driver'),
+            mock.patch.object(dhcp_fip, 'save', side_effect=fake_save),
+        ) as (mock_driver, mock_l3driver, mock_save):
+            manager._teardown_network_on_host(self.context, network)
+            address = lookups[0].wait()
+
+        mock_save.assert_called_once_with()
+        self.assertIsNone(dhcp_fip.host)
+        # the lookup waited for the release and reserved a new address
+        # rather than remembering the released one
+        self.assertEqual(netaddr.IPAddress('192.168.2.6'), address)
+        self.assertEqual(address, manager._dhcp_ips[network.id])
+        self.assertEqual(2, mock_get_by_net_host.call_count)
+
+    def _test_setup_network_on_host_ipv6(self, manager_cls, gateway_v6):
+        self.flags(fake_network=False, use_ipv6=True)
+        self.flags(lock_path=self.useFixture(fixtures.TempDir()).path,
+                   group='oslo_concurrency')
+        manager = manager_cls()
+        network = fake_network.fake_network_obj(self.context, 1)
+        network.vpn_public_address = '10.0.0.2'
+        network.enable_dhcp = True
+        network.gateway_v6 = gateway_v6
+
+        with test.nested(
+            mock.patch.object(manager, 'driver'),
+            mock.patch.object(manager, '_initialize_network'),
+            mock.patch.object(manager, '_get_dhcp_ip',
+                              return_value='192.168.1.1'),
+            mock.patch.object(network_manager, 'get_my_linklocal',
+                              return_value='fe80::1'),
+            mock.patch.object(network, 'save'),
+        ) as (mock_driver, mock_initialize, mock_get_dhcp_ip, mock_linklocal,
+              mock_save):
+            manager._setup_network_on_host(self.context, network)
+
+        self.assertEqual(netaddr.IPAddress('fe80::1'), network.gateway_v6)
+        return mock_save
+
+    def test_vlan_setup_network_on_host_saves_new_gateway_v6(self):
+        mock_save = self._test_setup_network_on_host_ipv6(
+            network_manager.VlanManager, 'fe80::2')
+        mock_save.assert_called_once_with()
+
+    def test_vlan_setup_network_on_host_gateway_v6_unchanged(self):
+        # Tests that the network is not saved again when its link local
+        # gateway has not changed.
+        mock_save = self._test_setup_network_on_host_ipv6(
+            network_manager.VlanManager, 'fe80::1')
+        self.assertFalse(mock_save.called)
+
+    def test_flatdhcp_setup_network_on_host_saves_new_gateway_v6(self):
+        mock_save = self._test_setup_network_on_host_ipv6(
+            network_manager.FlatDHCPManager, 'fe80::2')
+        mock_save.assert_called_once_with()
+
+    def test_flatdhcp_setup_network_on_host_gateway_v6_unchanged(self):
+        mock_save = self._test_setup_network_on_host_ipv6(
+            network_manager.FlatDHCPManager, 'fe80::1')
+        self.assertFalse(mock_save.called)